@@ -1,18 +1,63 @@
+import itertools
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
 
 load_dotenv()
 
+# Comma separated pool of keys (GEMINI_API_KEYS) — when one key hits its
+# rate limit, calls move on to the next one. A single GEMINI_API_KEY works too.
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
+GEMINI_API_KEYS = [
+    k.strip() for k in os.getenv("GEMINI_API_KEYS", GEMINI_API_KEY or "").split(",")
+    if k.strip()
+]
+if not GEMINI_API_KEYS:
     raise Exception("❌ Missing GEMINI_API_KEY in .env file")
 
-genai.configure(api_key=GEMINI_API_KEY)
+_key_cycle = itertools.cycle(GEMINI_API_KEYS)
+_current_key = next(_key_cycle)
 
-# FAST OCR + Classification (SUPPORTED!)
-GEMINI_OCR = genai.GenerativeModel("models/gemini-2.0-flash-lite")
-GEMINI_CLASSIFIER = genai.GenerativeModel("models/gemini-2.0-flash-lite")
+genai.configure(api_key=_current_key)
+
+# Deterministic, single candidate. Per-call generation_config (response
+# schemas) is merged on top of these by the SDK.
+# max_output_tokens stops a runaway repetition loop from streaming tokens
+# until the model limit, while leaving room for a whole batch (+ thinking).
+OCR_GENERATION_CONFIG = {"temperature": 0, "candidate_count": 1, "max_output_tokens": 8192}
+ITEMS_GENERATION_CONFIG = {"temperature": 0, "candidate_count": 1, "max_output_tokens": 32768}
+
+# FAST OCR (classification is rule-based, see extractor.classify_page_text)
+GEMINI_OCR = genai.GenerativeModel(
+    "models/gemini-2.0-flash-lite",
+    generation_config=OCR_GENERATION_CONFIG
+)
 
 # BEST accuracy for item extraction
-GEMINI_ITEMS = genai.GenerativeModel("models/gemini-2.5-flash")
+GEMINI_ITEMS = genai.GenerativeModel(
+    "models/gemini-2.5-flash",
+    generation_config=ITEMS_GENERATION_CONFIG
+)
+
+
+def current_api_key():
+    return _current_key
+
+
+def rotate_api_key(failed_key: str):
+    """
+    Switch every Gemini call to the next key of the pool.
+    No-op if another call already rotated away from `failed_key`.
+    """
+    global _current_key
+    if failed_key != _current_key:
+        return
+
+    _current_key = next(_key_cycle)
+    genai.configure(api_key=_current_key)
+
+    # Models keep the client they were first used with → drop it so the
+    # next call picks up a client for the new key
+    for model in (GEMINI_OCR, GEMINI_ITEMS):
+        model._client = None
+        model._async_client = None
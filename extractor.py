@@ -1,12 +1,38 @@
-from app.config import GEMINI_OCR, GEMINI_CLASSIFIER, GEMINI_ITEMS
+from app.config import (
+    GEMINI_OCR, GEMINI_ITEMS, GEMINI_API_KEYS, current_api_key, rotate_api_key
+)
+from app.renderer import BLANK_PAGE, render_page, render_pages
 
+import asyncio
+import diskcache
 import fitz
-import json
-import requests
+import hashlib
+import httpx
+import io
+import multiprocessing
+import orjson
+import os
+import re
+import threading
 import google.generativeai as genai
+from google.api_core.exceptions import (
+    DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable
+)
+from pydantic import BaseModel
+
+try:
+    import ahocorasick
+except ImportError:     # classifier falls back to a plain keyword loop
+    ahocorasick = None
 
 import logging
 import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import aclosing
+from dataclasses import dataclass
+from itertools import islice
 
 # Configure logger
 logging.basicConfig(
@@ -17,58 +43,397 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Max Gemini requests in flight across ALL documents being processed by
+# this worker (keeps us under the per-key RPM limits)
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "8"))
+GEMINI_SEMAPHORE = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+# Pages sent together in one multi-image Gemini call
+PAGES_PER_BATCH = 4
+
+
+# -----------------------------------------------------
+# CONTENT-ADDRESSED CACHE
+# -----------------------------------------------------
+# Per-page results are keyed by a hash of the page image → identical pages
+# (across documents too) skip Gemini entirely. Each downloaded file also
+# maps to the list of its page keys → a repeated document skips rendering.
+CACHE = diskcache.Cache(os.getenv("BILL_CACHE_DIR", "/tmp/bill_cache"), size_limit=10 << 30)
+
+
+def content_key(prefix: str, data: bytes):
+    # blake2b: ~2x the throughput of sha256 on multi-100KB page images
+    return f"{prefix}:{hashlib.blake2b(data, digest_size=16).hexdigest()}"
+
 
 # -----------------------------------------------------
 # HELPERS FOR FILE TYPE
 # -----------------------------------------------------
-def is_pdf(url: str):
-    return ".pdf" in url.lower()
+# Detected from the downloaded bytes, not the URL → signed URLs, query
+# strings and extension-less links are all classified correctly.
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG": "image/png",
+}
+
+
+def is_pdf(data: bytes):
+    # Readers tolerate junk before the header within the first 1 KB
+    return b"%PDF-" in data[:1024]
 
 
-def is_image(url: str):
-    url = url.lower()
-    return (".png" in url) or (".jpg" in url) or (".jpeg" in url)
+def image_mime_type(data: bytes):
+    """
+    MIME type of a JPEG / PNG body, None for anything else.
+    Such images are sent to Gemini as-is, without re-encoding.
+    """
+    for magic, mime_type in IMAGE_SIGNATURES.items():
+        if data.startswith(magic):
+            return mime_type
+    return None
 
 
 # -----------------------------------------------------
 # DOWNLOAD REMOTE FILE
 # -----------------------------------------------------
+# One pooled HTTP/2 client for all downloads → keep-alive reuses TCP/TLS
+# connections, and concurrent downloads from the same host (S3, CDNs) are
+# multiplexed over one connection. httpx negotiates gzip / deflate (+ br /
+# zstd when brotli / zstandard are installed) by itself.
+HTTP_CLIENT = httpx.Client(
+    timeout=20,
+    follow_redirects=True,
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=3,      # connect failures only
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    )
+)
+
+
+# Bigger downloads are rejected before they are buffered / rendered
+MAX_DOWNLOAD_BYTES = 50 * 1024 * 1024
+
+
 def download_from_url(url: str):
-    resp = requests.get(url, timeout=20)
-    if resp.status_code != 200:
-        raise Exception("Failed to download document")
-    return resp.content
+    with HTTP_CLIENT.stream("GET", url) as resp:
+        if resp.status_code != 200:
+            raise Exception("Failed to download document")
+
+        if int(resp.headers.get("Content-Length") or 0) > MAX_DOWNLOAD_BYTES:
+            raise Exception("Document too large")
+
+        buf = bytearray()
+        # Decoded bytes → the cap also holds for compressed responses
+        for chunk in resp.iter_bytes(65536):
+            buf.extend(chunk)
+            if len(buf) > MAX_DOWNLOAD_BYTES:
+                raise Exception("Document too large")
+
+    return bytes(buf)
 
 
 # -----------------------------------------------------
 # PDF → IMAGES
 # -----------------------------------------------------
-def convert_pdf_to_images(pdf_bytes: bytes):
-    images = []
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+# One render pool for the whole process: workers are started on first use
+# and reused by every later document instead of being spawned per request.
+# Never plain fork: this process already runs gRPC / httpx / to_thread
+# threads, and forking it can hang the children. forkserver workers come
+# from a clean server process that only preloads app.renderer.
+if "forkserver" in multiprocessing.get_all_start_methods():
+    RENDER_MP_CONTEXT = multiprocessing.get_context("forkserver")
+    RENDER_MP_CONTEXT.set_forkserver_preload(["app.renderer"])
+else:
+    RENDER_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+RENDER_WORKERS = os.cpu_count() or 1
+RENDER_POOL = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=RENDER_MP_CONTEXT)
+_render_pool_lock = threading.Lock()
+
+
+def _replace_render_pool(broken):
+    """
+    A worker that died (e.g. OOM-killed) breaks the pool for good →
+    swap in a fresh one. Returns the pool to use from now on.
+    """
+    global RENDER_POOL
+    with _render_pool_lock:
+        # Another document may have replaced it already
+        if RENDER_POOL is broken:
+            RENDER_POOL = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=RENDER_MP_CONTEXT)
+            broken.shutdown(wait=False, cancel_futures=True)
+        return RENDER_POOL
+
+
+def count_pdf_pages(pdf_bytes: bytes):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return doc.page_count
+
+
+def iter_pdf_pages(pdf_bytes: bytes):
+    """
+    Yields the rendered pages in order, one batch-sized page range per
+    process-pool job. At most one job per worker is in flight, so only a
+    few rendered pages are held in memory and the caller can start
+    extracting the first pages while the rest are still rendering.
+    """
+    total = count_pdf_pages(pdf_bytes)
+    jobs = [
+        (pdf_bytes, start, min(start + PAGES_PER_BATCH, total))
+        for start in range(0, total, PAGES_PER_BATCH)
+    ]
+
+    workers = min(len(jobs), RENDER_WORKERS)
+    if workers <= 1:
+        # Render in-process from ONE open document (no re-parse per range)
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            for page in doc:
+                yield render_page(page)
+        return
+
+    def render_jobs(pool, first):
+        in_flight = deque()
+        for job in jobs[first:]:
+            in_flight.append(pool.submit(render_pages, job))
+            if len(in_flight) >= workers:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    pool = RENDER_POOL
+    jobs_done = 0
+    retried = False
+
+    while True:
+        try:
+            for pages in render_jobs(pool, jobs_done):
+                jobs_done += 1
+                yield from pages
+            return
+
+        except BrokenProcessPool:
+            pool = _replace_render_pool(pool)
+            # Broken twice → likely this PDF kills workers: fail only it
+            if retried:
+                raise
+            retried = True
+            logger.warning(f"⚠ Render pool broken — restarting it from page {jobs_done * PAGES_PER_BATCH + 1}")
+
+
+# -----------------------------------------------------
+# IMAGE CONTENT FOR GEMINI
+# -----------------------------------------------------
+# Bigger images are uploaded ONCE through the File API and referenced by
+# URI, instead of being base64-inlined (+33%) into every request that uses
+# them (batch call, single page retry, OCR fallback).
+# Uploaded files belong to the project of the key that uploaded them, so
+# with a key pool a 429 rotation would leave them unreachable (403) →
+# images are only uploaded when a single key is configured.
+INLINE_IMAGE_LIMIT = 512 * 1024
+UPLOAD_IMAGES = len(GEMINI_API_KEYS) == 1
+
+
+async def image_part(img_bytes: bytes, mime_type: str):
+    if len(img_bytes) <= INLINE_IMAGE_LIMIT or not UPLOAD_IMAGES:
+        return {"mime_type": mime_type, "data": img_bytes}
+
+    try:
+        return await asyncio.to_thread(
+            genai.upload_file, io.BytesIO(img_bytes), mime_type=mime_type
+        )
+    except Exception as e:
+        logger.warning(f"❌ image upload error, sending inline: {e}")
+        return {"mime_type": mime_type, "data": img_bytes}
+
+
+async def release_image_part(image):
+    # Uploaded files count against the project's File API quota
+    if isinstance(image, dict):
+        return
+    try:
+        await asyncio.to_thread(genai.delete_file, image.name)
+    except Exception as e:
+        logger.warning(f"❌ uploaded image delete error: {e}")
+
+
+# -----------------------------------------------------
+# GEMINI CALLS (KEY ROTATION + RETRIES)
+# -----------------------------------------------------
+# Transient errors worth retrying: rate limit, overloaded, 5xx, timeout
+RETRYABLE_GEMINI_ERRORS = (
+    ResourceExhausted, ServiceUnavailable, InternalServerError, DeadlineExceeded
+)
+GEMINI_MAX_RETRIES = 3
+GEMINI_BACKOFF_MIN = 1      # seconds, doubled on every retry ...
+GEMINI_BACKOFF_MAX = 30     # ... up to this cap
+
+
+async def generate(model, contents, **kwargs):
+    """
+    model.generate_content_async with retries:
+    - 429 on the current key → retry right away with the next key of the pool
+    - 429 on every key, 5xx or timeout → exponential backoff (1s, 2s, 4s, ...)
+    The last error is re-raised once GEMINI_MAX_RETRIES backoffs are used up.
+    """
+    retries = 0
+    keys_tried = 1
+
+    while True:
+        key = current_api_key()
+        try:
+            resp = await model.generate_content_async(contents, **kwargs)
+            if retries:
+                logger.info(f"✔ Gemini call succeeded after {retries} retry(ies)")
+            return resp
+
+        except RETRYABLE_GEMINI_ERRORS as e:
+            if isinstance(e, ResourceExhausted) and keys_tried < len(GEMINI_API_KEYS):
+                keys_tried += 1
+                logger.warning("⚠ Gemini key rate limited — rotating to the next key")
+                rotate_api_key(key)
+                continue
 
-    for i in range(len(doc)):
-        page = doc.load_page(i)
-        pix = page.get_pixmap(dpi=200)
-        images.append(pix.tobytes("png"))
+            if retries == GEMINI_MAX_RETRIES:
+                logger.error(f"❌ Gemini call failed after {retries} retry(ies): {type(e).__name__}")
+                raise
 
-    return images
+            wait = min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_MIN * 2 ** retries)
+            retries += 1
+            keys_tried = 1
+            logger.warning(f"⚠ Gemini {type(e).__name__} — retry {retries}/{GEMINI_MAX_RETRIES} in {wait}s")
+            await asyncio.sleep(wait)
 
 
 # -----------------------------------------------------
 # GEMINI OCR
 # -----------------------------------------------------
-def gemini_ocr_extract(img_bytes: bytes):
-    resp = GEMINI_OCR.generate_content(
-        [
-            "Extract ONLY visible text from this hospital bill.",
-            {"mime_type": "image/png", "data": img_bytes}
-        ]
-    )
+OCR_PROMPT = "Extract ONLY visible text from this hospital bill."
+
+
+async def gemini_ocr_extract(image):
+    resp = await generate(GEMINI_OCR, [OCR_PROMPT, image])
     text = resp.text if hasattr(resp, "text") else ""
     return text, resp.usage_metadata
 
 
+# -----------------------------------------------------
+# FUSED OCR + ITEM EXTRACTION (single multimodal call)
+# -----------------------------------------------------
+class BillItem(BaseModel):
+    item_name: str
+    item_rate: str
+    item_quantity: str
+    item_amount: str
+
+
+class PageExtraction(BaseModel):
+    page_text: str
+    items: list[BillItem]
+
+
+class ItemsList(BaseModel):
+    items: list[BillItem]
+
+
+class BatchPageExtraction(BaseModel):
+    page_idx: int
+    page_text: str
+    items: list[BillItem]
+
+
+class BatchExtraction(BaseModel):
+    pages: list[BatchPageExtraction]
+
+
+PAGE_EXTRACTION_PROMPT = """
+This image is one page of a hospital bill.
+
+1. Put ALL visible text of the page, line by line, in "page_text".
+2. Put ONLY the bill line items of the page in "items".
+
+If no items exist, "items" must be [].
+"""
+
+BATCH_EXTRACTION_PROMPT = """
+Each of the following images is one page of a hospital bill,
+numbered from 0 in the order given.
+
+Return one entry in "pages" for EVERY image with:
+- "page_idx": the image number (0-based, in the order given)
+- "page_text": ALL visible text of that page, line by line
+- "items": ONLY the bill line items of that page ([] if none)
+"""
+
+
+async def extract_page_from_image(image):
+    """
+    Returns ({"page_text": ..., "items": [...]}, usage).
+    The dict is None when the model output could not be parsed, so the
+    caller can fall back to the OCR → text pipeline.
+    """
+    try:
+        resp = await generate(
+            GEMINI_ITEMS,
+            [
+                PAGE_EXTRACTION_PROMPT,
+                image
+            ],
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": PageExtraction
+            }
+        )
+    except Exception as e:
+        logger.warning(f"❌ page extraction error: {e}")
+        return None, DummyUsage()
+
+    try:
+        return orjson.loads(resp.text), resp.usage_metadata
+    except Exception as e:
+        logger.warning(f"❌ page extraction returned invalid JSON: {e}")
+        return None, resp.usage_metadata
+
+
+async def extract_pages_from_images(images: list):
+    """
+    Batched version of extract_page_from_image: one call for several pages.
+    Returns ({page_idx: {"page_text": ..., "items": [...]}}, usage);
+    the dict is None when the call or its JSON failed.
+    """
+    contents = [BATCH_EXTRACTION_PROMPT, *images]
+
+    try:
+        resp = await generate(
+            GEMINI_ITEMS,
+            contents,
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": BatchExtraction
+            }
+        )
+    except Exception as e:
+        logger.warning(f"❌ batch extraction error: {e}")
+        return None, DummyUsage()
+
+    try:
+        pages = orjson.loads(resp.text)["pages"]
+    except Exception as e:
+        logger.warning(f"❌ batch extraction returned invalid JSON: {e}")
+        return None, resp.usage_metadata
+
+    # A model numbering from 1 (or skipping / repeating a page) would shift
+    # texts onto the wrong pages — and those get cached by image hash →
+    # only an exact 0..n-1 numbering is trusted
+    page_idxs = sorted(p["page_idx"] for p in pages)
+    if page_idxs != list(range(len(images))):
+        logger.warning(f"❌ batch extraction returned page_idx {page_idxs} for {len(images)} image(s)")
+        return None, resp.usage_metadata
+
+    return {p["page_idx"]: p for p in pages}, resp.usage_metadata
+
+
 # -----------------------------------------------------
 # PAGE CLASSIFICATION
 # -----------------------------------------------------
@@ -76,143 +441,213 @@ class DummyUsage:
     def __init__(self):
         self.prompt_token_count = 0
         self.candidates_token_count = 0
+        self.cached_content_token_count = 0
 
 
-GLOBAL_PAGE_RESULTS = []
-
-
-def classify_page_text(text: str, pdf_pages_processed: int, total_pages: int):
-    t = text.lower()
-    lines = [l.strip() for l in t.split("\n") if l.strip()]
-
-    # ================================================================
-    # 0) HARD PHARMACY DETECTION — RETAIL DRUG BILL COLUMN HEADERS
-    # ================================================================
-    pharmacy_headers = [
+# -----------------------------------------------------
+# CLASSIFIER KEYWORDS
+# -----------------------------------------------------
+# Every keyword list used by classify_page_text, grouped by bucket.
+# They are compiled once into a single Aho-Corasick automaton so a page
+# is scanned in ONE pass instead of one `in` scan per keyword.
+CLASSIFIER_KEYWORDS = {
+    # Retail drug bill column headers
+    "pharmacy_headers": frozenset({
         "batch no", "batch", "exp", "expiry", "exp dt",
         "mfr", "manufacturer", "sch", "rs", "ps",
         "name of drug", "particulars"
-    ]
+    }),
 
-    header_hits = sum(1 for h in pharmacy_headers if h in t)
-
-    # If ≥4 retail headers → guaranteed PHARMACY
-    if header_hits >= 4:
-        GLOBAL_PAGE_RESULTS.append("Pharmacy")
-        return "Pharmacy", DummyUsage()
-
-    # ================================================================
-    # 1) STRONG NON-PHARMACY OVERRIDE
-    # (These metadata appear ONLY in hospital bill details / final bill)
-    # ================================================================
-    non_pharmacy_forced = [
+    # Metadata that appears ONLY in hospital bill details / final bill
+    "non_pharmacy_forced": frozenset({
         "admission date", "discharge date", "patient name",
         "patient regn", "bill date", "bill no", "ip no",
         "uhid", "ward", "room rent", "bed charges"
-    ]
-
-    if any(x in t for x in non_pharmacy_forced):
-        GLOBAL_PAGE_RESULTS.append("Bill Detail")
-        return "Bill Detail", DummyUsage()
+    }),
 
-    # ================================================================
-    # 2) FINAL BILL DETECTION
-    # ================================================================
-    final_bill_signals = [
+    "final_bill_signals": frozenset({
         "admission date", "discharge date",
         "patient name", "bill no", "uhid",
         "net amount payable", "total bill amount",
         "grand total", "amount received"
-    ]
+    }),
 
-    final_bill_categories = [
+    "final_bill_categories": frozenset({
         "consultation", "room rent", "bed charges",
         "investigation", "laboratory", "radiology",
         "pathology", "pharmacy", "procedures",
         "surgery", "medical consumable"
-    ]
-
-    has_signals = sum(k in t for k in final_bill_signals) >= 2
-    has_cat = sum(k in t for k in final_bill_categories) >= 1
+    }),
 
-    if has_signals and has_cat:
-        GLOBAL_PAGE_RESULTS.append("Final Bill")
-        return "Final Bill", DummyUsage()
-
-    # ================================================================
-    # 3) BILL DETAIL DETECTION
-    # ================================================================
-    import re
-    numeric_row_pattern = r"\b(\d+\.?\d*)\s+(\d+\.?\d*)\s+(\d+\.?\d*)"
-    numeric_rows = len(re.findall(numeric_row_pattern, t))
-
-    if numeric_rows >= 5:
-        GLOBAL_PAGE_RESULTS.append("Bill Detail")
-        return "Bill Detail", DummyUsage()
-
-    bill_detail_keywords = [
+    "bill_detail_keywords": frozenset({
         "x-ray", "xray", "usg", "ultrasound", "echo", "2d echo",
         "mri", "ct", "ecg", "cbc", "blood", "culture", "serum",
         "crp", "lft", "kft", "widal", "hba1c",
         "radiology", "pathology", "laboratory"
-    ]
+    }),
 
-    if any(k in t for k in bill_detail_keywords):
-        GLOBAL_PAGE_RESULTS.append("Bill Detail")
-        return "Bill Detail", DummyUsage()
-
-    # ================================================================
-    # 4) PHARMACY (Soft Logic — Only if no contradiction)
-    # ================================================================
-    pharmacy_keywords = [
+    "pharmacy_keywords": frozenset({
         "pharmacy", "drug", "mrp", "cgst", "sgst", "igst",
         "tablet", "tab", "capsule", "cap", "syrup", "syp",
         "injection", "inj", "vial", "ointment", "gel"
-    ]
-
-    pharm_hits = sum(k in t for k in pharmacy_keywords)
+    }),
 
-    non_pharmacy_markers = [
+    "non_pharmacy_markers": frozenset({
         "consultation", "procedure", "surgery", "doctor",
         "dr.", "dietician", "admission", "discharge",
         "room rent", "bed charges"
-    ]
+    })
+}
+
+
+def _group_by_keyword(keyword_buckets):
+    # A keyword may belong to several buckets (e.g. "room rent")
+    buckets_by_keyword = {}
+    for bucket, keywords in keyword_buckets.items():
+        for kw in keywords:
+            buckets_by_keyword.setdefault(kw, []).append(bucket)
+
+    return {kw: tuple(buckets) for kw, buckets in buckets_by_keyword.items()}
+
+
+def _build_keyword_automaton(buckets_by_keyword):
+    automaton = ahocorasick.Automaton()
+    for kw, buckets in buckets_by_keyword.items():
+        automaton.add_word(kw, (kw, buckets))
+    automaton.make_automaton()
+    return automaton
 
-    non_pharm_hits = sum(k in t for k in non_pharmacy_markers)
+
+KEYWORD_BUCKETS = _group_by_keyword(CLASSIFIER_KEYWORDS)
+KEYWORD_AUTOMATON = _build_keyword_automaton(KEYWORD_BUCKETS) if ahocorasick else None
+
+# "\d+(?:\.\d*)?" matches exactly what "\d+\.?\d*" did, but a digit run
+# can only be split one way → no quadratic backtracking on long OCR'd
+# digit strings (barcodes, account numbers) that are not followed by a row
+NUMERIC_ROW_RE = re.compile(r"\b\d+(?:\.\d*)?\s+\d+(?:\.\d*)?\s+\d+(?:\.\d*)?")
+
+# Pages with this many "rate qty amount" rows are Bill Detail
+MIN_NUMERIC_ROWS = 5
+
+# Retail pharmacy bills always carry at least one of these columns
+# (one case-insensitive scan, no lowercase copy of the page text)
+PHARMACY_STRUCTURE_RE = re.compile(r"rs|exp|batch|ps|mfr", re.IGNORECASE)
+
+
+def count_keyword_hits(t: str):
+    """
+    Number of DISTINCT keywords of each bucket present in `t`
+    (same result as `sum(k in t for k in bucket)`, in a single pass).
+    """
+    hits = Counter()
+
+    if KEYWORD_AUTOMATON is None:
+        # stdlib route: one loop over every keyword, feeding all its buckets
+        for kw, buckets in KEYWORD_BUCKETS.items():
+            if kw in t:
+                for bucket in buckets:
+                    hits[bucket] += 1
+        return hits
+
+    seen = set()
+    for _, (kw, buckets) in KEYWORD_AUTOMATON.iter(t):
+        if kw in seen:
+            continue
+        seen.add(kw)
+        for bucket in buckets:
+            hits[bucket] += 1
+
+    return hits
+
+
+def classify_page_text(text: str, pdf_pages_processed: int, total_pages: int):
+    t = text.lower()
+
+    hits = count_keyword_hits(t)
+
+    # Stop scanning at the MIN_NUMERIC_ROWS-th match — more never matters.
+    # Pages are scanned one at a time on purpose: one scan over the joined
+    # texts of a batch loses this cap and pays a bisect per match (~2x
+    # slower on 4-page batches)
+    numeric_rows = sum(1 for _ in islice(NUMERIC_ROW_RE.finditer(t), MIN_NUMERIC_ROWS))
+
+    # Returned to the caller so it can skip item extraction on pages
+    # that cannot contain line items
+    features = {
+        "header_hits": hits["pharmacy_headers"],
+        "numeric_rows": numeric_rows,
+        "pharm_hits": hits["pharmacy_keywords"]
+    }
+
+    # ================================================================
+    # 0) HARD PHARMACY DETECTION — RETAIL DRUG BILL COLUMN HEADERS
+    # ================================================================
+    # If ≥4 retail headers → guaranteed PHARMACY
+    if hits["pharmacy_headers"] >= 4:
+        return "Pharmacy", DummyUsage(), features
+
+    # ================================================================
+    # 1) STRONG NON-PHARMACY OVERRIDE
+    # (These metadata appear ONLY in hospital bill details / final bill)
+    # ================================================================
+    if hits["non_pharmacy_forced"]:
+        return "Bill Detail", DummyUsage(), features
+
+    # ================================================================
+    # 2) FINAL BILL DETECTION
+    # ================================================================
+    has_signals = hits["final_bill_signals"] >= 2
+    has_cat = hits["final_bill_categories"] >= 1
+
+    if has_signals and has_cat:
+        return "Final Bill", DummyUsage(), features
+
+    # ================================================================
+    # 3) BILL DETAIL DETECTION
+    # ================================================================
+    if numeric_rows >= MIN_NUMERIC_ROWS:
+        return "Bill Detail", DummyUsage(), features
+
+    if hits["bill_detail_keywords"]:
+        return "Bill Detail", DummyUsage(), features
+
+    # ================================================================
+    # 4) PHARMACY (Soft Logic — Only if no contradiction)
+    # ================================================================
+    pharm_hits = hits["pharmacy_keywords"]
+    non_pharm_hits = hits["non_pharmacy_markers"]
 
     # Soft-pharmacy allowed only if:
     # - at least 3 pharmacy hints
     # - NO non-pharmacy hints
     if pharm_hits >= 3 and non_pharm_hits == 0:
-        GLOBAL_PAGE_RESULTS.append("Pharmacy")
-        return "Pharmacy", DummyUsage()
+        return "Pharmacy", DummyUsage(), features
 
     # ================================================================
     # 5) DEFAULT → BILL DETAIL (Safest)
     # ================================================================
-    GLOBAL_PAGE_RESULTS.append("Bill Detail")
-    return "Bill Detail", DummyUsage()
+    return "Bill Detail", DummyUsage(), features
 
 
 
 # ===================================================================
 # FINAL GLOBAL FIX (continuation pages)
 # ===================================================================
-def fix_global_page_classification(pagewise_results):
+def fix_global_page_classification(pagewise_results, ocr_texts):
 
     # If any page is Bill Detail → pharmacy must be validated
-    if any(pg["page_type"] == "Bill Detail" for pg in pagewise_results):
+    if any(pg.page_type == "Bill Detail" for pg in pagewise_results):
 
-        for pg in pagewise_results:
-            txt = pg.get("ocr_text", "").lower()
+        for pg, txt in zip(pagewise_results, ocr_texts):
+            # Only Pharmacy pages can be overridden → don't scan the rest
+            if pg.page_type != "Pharmacy":
+                continue
 
             # Page marked Pharmacy but missing pharmacy structure = wrong
-            missing_pharmacy_structure = (
-                not any(x in txt for x in ["batch", "exp", "rs", "ps", "mfr"])
-            )
+            missing_pharmacy_structure = PHARMACY_STRUCTURE_RE.search(txt) is None
 
-            if pg["page_type"] == "Pharmacy" and missing_pharmacy_structure:
-                pg["page_type"] = "Bill Detail"
+            if missing_pharmacy_structure:
+                pg.page_type = "Bill Detail"
 
     return pagewise_results
 
@@ -220,165 +655,520 @@ def fix_global_page_classification(pagewise_results):
 # -----------------------------------------------------
 # ITEM EXTRACTION
 # -----------------------------------------------------
-def extract_items_from_text(text: str, page_type: str):
+async def extract_items_from_text(text: str, page_type: str):
 
     model = GEMINI_ITEMS
 
+    # Keep the instruction block identical for every page (page_type and
+    # text go last) so Gemini's implicit prompt caching can reuse it.
     prompt = f"""
-Extract ONLY the bill line items from this {page_type} page.
-
-Return STRICT JSON ONLY:
+Extract ONLY the bill line items from this page.
 
-[
-  {{
-    "item_name": "...",
-    "item_rate": "...",
-    "item_quantity": "...",
-    "item_amount": "..."
-  }}
-]
+If no items exist, "items" must be [].
 
-If no items exist, return [] ONLY.
+PAGE TYPE: {page_type}
 
 TEXT:
 {text}
 """
 
     try:
-        resp = model.generate_content(prompt)
-        usage = resp.usage_metadata
+        resp = await generate(
+            model,
+            prompt,
+            generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": ItemsList
+            }
+        )
+        return orjson.loads(resp.text)["items"], resp.usage_metadata
 
-        raw = resp.text.strip()
-        raw = raw.replace("```", "").replace("json", "").strip()
+    except Exception as e:
+        logger.error(f"❌ item extraction error: {e}")
+        return [], DummyUsage()
 
-        start = raw.find("[")
-        end = raw.rfind("]") + 1
 
-        if start == -1 or end == -1:
-            return [], usage
+# -----------------------------------------------------
+# PAGE RESULT
+# -----------------------------------------------------
+@dataclass(slots=True)
+class PageResult:
+    page_no: str
+    page_type: str
+    bill_items: list
+
+    def as_dict(self):
+        # dataclasses.asdict() would rebuild every item dict (~8ms per 1000
+        # items); the items are already plain JSON dicts → share them
+        return {
+            "page_no": self.page_no,
+            "page_type": self.page_type,
+            "bill_items": self.bill_items
+        }
 
-        items_json = raw[start:end]
 
-        try:
-            return json.loads(items_json), usage
-        except:
-            pass
+# -----------------------------------------------------
+# SINGLE PAGE PIPELINE
+# -----------------------------------------------------
+# Pipelines return (PageResult, ocr_text): the OCR text is only needed by
+# fix_global_page_classification and never becomes part of the response.
+def page_from_cache(page_no: int, img_bytes: bytes):
+    cached = CACHE.get(content_key("page", img_bytes))
+    if cached is None:
+        return None
+
+    text, page_type, items = cached
+    logger.info(f"✔ PAGE {page_no}: served from cache ({page_type}, {len(items)} item(s))")
+    return PageResult(str(page_no), page_type, items), text
+
+
+def document_from_cache(doc_key: str):
+    """
+    All pages of a previously processed file, or None if the file is new
+    or any of its pages is missing from the cache (failed / evicted).
+    """
+    page_keys = CACHE.get(doc_key)
+    if page_keys is None:
+        return None
+
+    cached = [CACHE.get(key) for key in page_keys]
+    if any(c is None for c in cached):
+        return None
+
+    return [
+        (PageResult(str(page_no), page_type, items), text)
+        for page_no, (text, page_type, items) in enumerate(cached, start=1)
+    ]
 
-        # Fix common issues
-        import re
-        fixed = re.sub(r",\s*}", "}", items_json)
-        fixed = re.sub(r",\s*]", "]", fixed)
-        fixed = fixed.replace("'", '"')
 
-        return json.loads(fixed), usage
+def classify_page(page_no: int, text: str, total_pages: int):
+    t1 = time.time()
+    page_type, usage, features = classify_page_text(
+        text,
+        pdf_pages_processed=page_no - 1,
+        total_pages=total_pages
+    )
+    logger.info(f"✔ PAGE {page_no}: classified as {page_type} (in {time.time()-t1:.2f}s)")
+    return page_type, usage, features
+
+
+def no_items_expected(page_type: str, features: dict):
+    """
+    Final Bill pages only carry totals, and a page with no numeric rows
+    and no pharmacy hints has no line items. Applied on EVERY path, so a
+    page's items never depend on which Gemini call happened to succeed.
+    """
+    return (
+        page_type == "Final Bill"
+        or (features["numeric_rows"] == 0 and not features["pharm_hits"])
+    )
 
-    except Exception as e:
-        print("❌ item extraction error:", e)
-        return [], {"prompt_token_count": 0, "candidates_token_count": 0}
+
+async def process_page(page_no: int, img_bytes: bytes, image, total_pages: int):
+    cached = await asyncio.to_thread(page_from_cache, page_no, img_bytes)
+    if cached is not None:
+        return cached, []
+
+    logger.info(f"▶ PAGE {page_no}: started")
+    usages = []
+
+    # OCR + ITEMS IN ONE CALL
+    t1 = time.time()
+    async with GEMINI_SEMAPHORE:
+        extracted, u1 = await extract_page_from_image(image)
+    usages.append(u1)
+
+    if extracted is not None:
+        text = extracted["page_text"]
+        items = extracted["items"]
+        logger.info(f"✔ PAGE {page_no}: OCR + {len(items)} item(s) in {time.time()-t1:.2f}s")
+
+    else:
+        # FALLBACK: plain OCR, items extracted from the text afterwards
+        logger.warning(f"⚠ PAGE {page_no}: fused extraction failed — falling back to OCR")
+        t1 = time.time()
+        async with GEMINI_SEMAPHORE:
+            text, u2 = await gemini_ocr_extract(image)
+        usages.append(u2)
+        logger.info(f"✔ PAGE {page_no}: OCR completed in {time.time()-t1:.2f}s")
+
+    # CLASSIFICATION
+    page_type, u3, features = classify_page(page_no, text, total_pages)
+    usages.append(u3)
+
+    # Fallback → no item call at all; fused → its items are dropped
+    if no_items_expected(page_type, features):
+        items = []
+        logger.info(f"✔ PAGE {page_no}: no line items expected ({page_type})")
+
+    elif extracted is None:
+        t1 = time.time()
+        async with GEMINI_SEMAPHORE:
+            items, u4 = await extract_items_from_text(text, page_type)
+        usages.append(u4)
+        logger.info(f"✔ PAGE {page_no}: extracted {len(items)} item(s) in {time.time()-t1:.2f}s")
+
+    # Only the structured path tells a real "no items" apart from an error
+    if extracted is not None:
+        await asyncio.to_thread(CACHE.set, content_key("page", img_bytes), (text, page_type, items))
+
+    return (PageResult(str(page_no), page_type, items), text), usages
 
 
 # -----------------------------------------------------
-# MASTER EXTRACTION FUNCTION
+# MULTI PAGE PIPELINE (one Gemini call per batch)
 # -----------------------------------------------------
-def extract_document(url: str):
-    logger.info("====================================================")
-    logger.info(f"STARTING EXTRACTION")
-    logger.info(f"Document URL: {url}")
-    logger.info("====================================================")
+async def process_batch(batch: list, mime_type: str, total_pages: int):
+    """
+    batch: [(page_no, img_bytes), ...]
+    Uncached pages are extracted together in ONE Gemini call; any page the
+    batch call misses goes through the single page pipeline instead.
+    Returns (pages, usages).
+    """
+    pages = {}
+    usages = []
+
+    # diskcache is SQLite + file I/O → keep it off the event loop
+    cached_pages = await asyncio.gather(*[
+        asyncio.to_thread(page_from_cache, page_no, img_bytes)
+        for page_no, img_bytes in batch
+    ])
+
+    pending = []
+    for (page_no, img_bytes), cached in zip(batch, cached_pages):
+        if cached is not None:
+            pages[page_no] = cached
+        elif img_bytes == BLANK_PAGE:
+            logger.info(f"✔ PAGE {page_no}: blank — skipped")
+            pages[page_no] = (PageResult(str(page_no), "Blank", []), "")
+            await asyncio.to_thread(CACHE.set, content_key("page", img_bytes), ("", "Blank", []))
+        else:
+            pending.append((page_no, img_bytes))
+
+    # Content parts are built once and shared by the batch call and retries
+    images = dict(zip(
+        [page_no for page_no, _ in pending],
+        await asyncio.gather(*[image_part(img_bytes, mime_type) for _, img_bytes in pending])
+    ))
 
-    overall_start = time.time()
+    try:
+        leftovers = pending
+        if len(pending) > 1:
+            first, last = pending[0][0], pending[-1][0]
+            logger.info(f"▶ PAGES {first}-{last}: started ({len(pending)} page(s) in one call)")
+
+            t1 = time.time()
+            async with GEMINI_SEMAPHORE:
+                extracted, usage = await extract_pages_from_images(
+                    [images[page_no] for page_no, _ in pending]
+                )
+            usages.append(usage)
+            logger.info(f"✔ PAGES {first}-{last}: batch call completed in {time.time()-t1:.2f}s")
+
+            extracted = extracted or {}
+            leftovers = []
+
+            for idx, (page_no, img_bytes) in enumerate(pending):
+                result = extracted.get(idx)
+                if result is None:
+                    leftovers.append((page_no, img_bytes))
+                    continue
+
+                text, items = result["page_text"], result["items"]
+                page_type, u, features = classify_page(page_no, text, total_pages)
+                usages.append(u)
+
+                if no_items_expected(page_type, features):
+                    items = []
+
+                await asyncio.to_thread(CACHE.set, content_key("page", img_bytes), (text, page_type, items))
+                pages[page_no] = (PageResult(str(page_no), page_type, items), text)
+
+            if leftovers:
+                logger.warning(f"⚠ PAGES {first}-{last}: {len(leftovers)} page(s) missing from batch — retrying one by one")
+
+        results = await asyncio.gather(*[
+            process_page(page_no, img_bytes, images[page_no], total_pages)
+            for page_no, img_bytes in leftovers
+        ])
+        for (page, text), page_usages in results:
+            pages[int(page.page_no)] = (page, text)
+            usages.extend(page_usages)
+
+    finally:
+        await asyncio.gather(*[release_image_part(image) for image in images.values()])
+
+    return [pages[page_no] for page_no, _ in batch], usages
+
+
+# Pages rendered ahead of the consumer. Together with BATCHES_IN_FLIGHT
+# this caps the JPEGs a document holds: once that many batches wait on
+# Gemini, the queue fills up and the render thread pauses.
+RENDER_QUEUE_SIZE = 2 * PAGES_PER_BATCH
+
+# Batches of ONE document alive at once (waiting on or inside Gemini) —
+# enough to fill every GEMINI_SEMAPHORE slot on its own
+BATCHES_IN_FLIGHT = GEMINI_CONCURRENCY
+
+
+async def stream_batches(pages):
+    """
+    Groups a (possibly lazy) page iterator into [(page_no, img_bytes), ...]
+    batches. A producer thread drains the iterator into a bounded queue, so
+    rendering runs ahead while Gemini calls are in flight instead of waiting
+    for the event loop to ask for each page.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=RENDER_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def put(item):
+        # Blocks the producer while the queue is full
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        end = None
+        try:
+            for img_bytes in pages:
+                if stop.is_set():
+                    return
+                put(img_bytes)
+        except Exception as e:
+            end = e
+        put(end)
 
-    file_bytes = download_from_url(url)
-    logger.info("✔ File downloaded successfully")
+    threading.Thread(target=produce, daemon=True).start()
 
-    if is_image(url):
-        logger.info("✔ Detected IMAGE file")
-        pages = [file_bytes]
-    else:
-        logger.info("✔ Detected PDF file — converting to images...")
-        t_pdf = time.time()
-        pages = convert_pdf_to_images(file_bytes)
-        logger.info(f"✔ PDF converted to {len(pages)} page(s) in {time.time()-t_pdf:.2f}s")
+    batch = []
+    page_no = 0
 
-    final_output = []
-    total_items = 0
+    try:
+        while (item := await queue.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
 
-    total_in = 0
-    total_out = 0
+            page_no += 1
+            batch.append((page_no, item))
+            if len(batch) == PAGES_PER_BATCH:
+                yield batch
+                batch = []
 
-    GLOBAL_PAGE_RESULTS.clear()
+        if batch:
+            yield batch
 
-    # ---------------- PROCESS EACH PAGE ----------------
-    for page_no, img_bytes in enumerate(pages, start=1):
+    finally:
+        # Consumer gone early → unblock the producer so it can exit
+        stop.set()
+        while not queue.empty():
+            queue.get_nowait()
 
-        logger.info("----------------------------------------------------")
-        logger.info(f"PROCESSING PAGE {page_no}")
-        logger.info("----------------------------------------------------")
 
-        # OCR
-        t1 = time.time()
-        text, u1 = gemini_ocr_extract(img_bytes)
-        logger.info(f"✔ OCR completed in {time.time()-t1:.2f}s")
+# -----------------------------------------------------
+# DOCUMENT PIPELINE
+# -----------------------------------------------------
+async def extract_batches(url: str):
+    """
+    Async generator over (pages, usages) of every batch, in COMPLETION
+    order (pages = [(PageResult, ocr_text), ...]). A fully cached document
+    comes back as one batch without rendering.
+    """
+    file_bytes = await asyncio.to_thread(download_from_url, url)
+    logger.info("✔ File downloaded successfully")
 
-        total_in += u1.prompt_token_count
-        total_out += u1.candidates_token_count
+    doc_key = content_key("doc", file_bytes)
+    cached_pages = await asyncio.to_thread(document_from_cache, doc_key)
 
-        # CLASSIFICATION
-        t1 = time.time()
-        page_type, u2 = classify_page_text(
-            text,
-            pdf_pages_processed=page_no - 1,
-            total_pages=len(pages)
-        )
-        logger.info(f"✔ Page classified as: {page_type} (in {time.time()-t1:.2f}s)")
+    if cached_pages is not None:
+        logger.info(f"✔ Document served from cache ({len(cached_pages)} page(s))")
+        yield cached_pages, []
+        return
 
-        total_in += u2.prompt_token_count
-        total_out += u2.candidates_token_count
+    mime_type = image_mime_type(file_bytes)
 
-        # ITEM EXTRACTION
-        t1 = time.time()
-        items, u3 = extract_items_from_text(text, page_type)
-        logger.info(f"✔ Extracted {len(items)} item(s) in {time.time()-t1:.2f}s")
+    if mime_type is not None:
+        logger.info("✔ Detected IMAGE file")
+        total_pages = 1
+        pages = iter([file_bytes])
+    elif is_pdf(file_bytes):
+        total_pages = await asyncio.to_thread(count_pdf_pages, file_bytes)
+        logger.info(f"✔ Detected PDF file with {total_pages} page(s) — rendering while extracting...")
+        pages = iter_pdf_pages(file_bytes)
+        mime_type = "image/jpeg"
+    else:
+        raise Exception("Unsupported document type")
+
+    # ---------------- PROCESS BATCHES AS SOON AS THEY ARE RENDERED ----------------
+    # Every task (the batches and the scheduler itself) reports here when done
+    completed = asyncio.Queue()
+    tasks = []
+
+    def submit(coro):
+        task = asyncio.create_task(coro)
+        task.add_done_callback(completed.put_nowait)
+        tasks.append(task)
+        return task
+
+    in_flight = asyncio.Semaphore(BATCHES_IN_FLIGHT)
+
+    async def schedule():
+        page_keys = []
+        async for batch in stream_batches(pages):
+            page_keys += [content_key("page", img_bytes) for _, img_bytes in batch]
+            # Stop pulling rendered pages while Gemini is behind
+            await in_flight.acquire()
+            task = submit(process_batch(batch, mime_type, total_pages))
+            task.add_done_callback(lambda _: in_flight.release())
+        return page_keys
+
+    scheduler = submit(schedule())
+    batch_count = -(-total_pages // PAGES_PER_BATCH)
 
-        total_in += u3.prompt_token_count
-        total_out += u3.candidates_token_count
-        total_items += len(items)
+    try:
+        for _ in range(batch_count + 1):
+            task = await completed.get()
+            result = task.result()      # re-raises render / extraction errors
+            if task is not scheduler:
+                yield result
 
-        final_output.append({
-            "page_no": str(page_no),
-            "page_type": page_type,
-            "ocr_text": text,     # needed for global override
-            "bill_items": items
-        })
+    finally:
+        # Failed batch or consumer gone → stop rendering (the scheduler's
+        # stream_batches releases the producer thread) and stop spending
+        # Gemini quota / semaphore slots on pages nobody will read
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-    # ---------------- APPLY GLOBAL FIX ----------------
-    final_output = fix_global_page_classification(final_output)
+    await asyncio.to_thread(CACHE.set, doc_key, scheduler.result())
+
+
+def add_token_usage(tokens: Counter, usages):
+    for u in usages:
+        tokens["input"] += u.prompt_token_count
+        tokens["output"] += u.candidates_token_count
+        tokens["cached"] += getattr(u, "cached_content_token_count", 0) or 0
 
-    # Remove OCR text from final response
-    for pg in final_output:
-        pg.pop("ocr_text", None)
 
-    # LOG
+def token_usage(tokens: Counter):
+    return {
+        "total_tokens": tokens["input"] + tokens["output"],
+        "input_tokens": tokens["input"],
+        "output_tokens": tokens["output"]
+    }
+
+
+def log_start(url: str):
+    logger.info("====================================================")
+    logger.info(f"STARTING EXTRACTION")
+    logger.info(f"Document URL: {url}")
+    logger.info("====================================================")
+
+
+def log_summary(total_pages: int, total_items: int, tokens: Counter, overall_start: float):
+    total_in, total_out, total_cached = tokens["input"], tokens["output"], tokens["cached"]
     total_time = time.time() - overall_start
 
     logger.info("====================================================")
     logger.info("EXTRACTION COMPLETED 🎉")
-    logger.info(f"Total Pages        : {len(pages)}")
+    logger.info(f"Total Pages        : {total_pages}")
     logger.info(f"Total Items        : {total_items}")
     logger.info(f"Total Tokens Used  : {total_in + total_out} (in={total_in}, out={total_out})")
+    logger.info(f"Cached Input Tokens: {total_cached} (billed uncached in={total_in - total_cached})")
     logger.info(f"Total Time Taken   : {total_time:.2f} seconds")
     logger.info("====================================================")
 
+
+# -----------------------------------------------------
+# MASTER EXTRACTION FUNCTION
+# -----------------------------------------------------
+async def extract_document(url: str):
+    log_start(url)
+    overall_start = time.time()
+
+    pages = []
+    tokens = Counter()
+
+    async with aclosing(extract_batches(url)) as batches:
+        async for batch_pages, usages in batches:
+            add_token_usage(tokens, usages)
+            pages.extend(batch_pages)
+
+    # Batches complete out of order
+    pages.sort(key=lambda p: int(p[0].page_no))
+
+    final_output = [page for page, _ in pages]
+    ocr_texts = [text for _, text in pages]     # only for the global fix
+    total_items = sum(len(page.bill_items) for page in final_output)
+
+    # ---------------- APPLY GLOBAL FIX ----------------
+    final_output = fix_global_page_classification(final_output, ocr_texts)
+
+    log_summary(len(final_output), total_items, tokens, overall_start)
+
     # BAJAJ FORMAT
     return {
         "is_success": True,
-        "token_usage": {
-            "total_tokens": total_in + total_out,
-            "input_tokens": total_in,
-            "output_tokens": total_out
-        },
+        "token_usage": token_usage(tokens),
         "data": {
-            "pagewise_line_items": final_output,
+            "pagewise_line_items": [pg.as_dict() for pg in final_output],
             "total_item_count": total_items
         }
     }
+
+
+# -----------------------------------------------------
+# STREAMING EXTRACTION (one result per page as it completes)
+# -----------------------------------------------------
+async def stream_document(url: str):
+    """
+    Async generator of NDJSON-ready dicts: one per page as soon as its
+    batch completes (in completion order), then a summary with the token
+    usage and total_item_count.
+
+    Pages the global fix may still demote (Pharmacy without pharmacy
+    structure) are held back until a Bill Detail page shows up or the
+    document ends, so every page is emitted with its final page_type.
+    """
+    log_start(url)
+    overall_start = time.time()
+
+    tokens = Counter()
+    total_pages = 0
+    total_items = 0
+
+    bill_detail_seen = False
+    held = []
+
+    # Closed right away when the client goes → in-flight batches are cancelled
+    async with aclosing(extract_batches(url)) as batches:
+        async for batch_pages, usages in batches:
+            add_token_usage(tokens, usages)
+
+            for page, text in batch_pages:
+                total_pages += 1
+                total_items += len(page.bill_items)
+
+                if page.page_type == "Bill Detail" and not bill_detail_seen:
+                    bill_detail_seen = True
+                    for held_page in held:
+                        held_page.page_type = "Bill Detail"
+                        yield held_page.as_dict()
+                    held = []
+
+                if page.page_type == "Pharmacy" and PHARMACY_STRUCTURE_RE.search(text) is None:
+                    if not bill_detail_seen:
+                        held.append(page)
+                        continue
+                    page.page_type = "Bill Detail"
+
+                yield page.as_dict()
+
+    for page in held:
+        yield page.as_dict()
+
+    log_summary(total_pages, total_items, tokens, overall_start)
+
+    yield {
+        "is_success": True,
+        "token_usage": token_usage(tokens),
+        "total_item_count": total_items
+    }
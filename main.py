@@ -1,6 +1,11 @@
+import os
+from contextlib import aclosing
+
+import orjson
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.extractor import extract_document
+from app.extractor import extract_document, stream_document
 
 app = FastAPI()
 
@@ -8,9 +13,30 @@ class ExtractRequest(BaseModel):
     document: str
 
 @app.post("/extract")
-def extract_bill(payload: ExtractRequest):
+async def extract_bill(payload: ExtractRequest):
     try:
         # CORRECT: pass only the string URL
-        return extract_document(payload.document)
+        return await extract_document(payload.document)
     except Exception as e:
         return {"is_success": False, "error": str(e)}
+
+
+# NDJSON: one line per page as soon as it is extracted, then a summary line
+@app.post("/extract/stream")
+async def extract_bill_stream(payload: ExtractRequest):
+    async def lines():
+        try:
+            async with aclosing(stream_document(payload.document)) as document_lines:
+                async for line in document_lines:
+                    yield orjson.dumps(line) + b"\n"
+        except Exception as e:
+            yield orjson.dumps({"is_success": False, "error": str(e)}) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvicorn[standard] brings uvloop + httptools, picked up automatically
+    uvicorn.run("app.main:app", host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
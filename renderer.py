@@ -0,0 +1,50 @@
+# -----------------------------------------------------
+# PDF PAGE RENDERING (runs inside the render pool workers)
+# -----------------------------------------------------
+# Kept free of app.config / Gemini / cache / HTTP imports: a worker only
+# needs this module, so starting one costs an import of fitz + numpy and
+# no API key, diskcache handle or client.
+import fitz
+import numpy as np
+
+# 150 DPI is plenty for OCR and has ~44% fewer pixels than 200 DPI
+PDF_RENDER_DPI = 150
+# MuPDF's own JPEG encoder (no PNG/DEFLATE pass); raise towards 92 if
+# compression artifacts start hurting OCR of tiny text
+PDF_JPEG_QUALITY = 80
+# Gemini tiles images into 768px squares → pixels beyond 2 tiles on the
+# long side only cost tokens (an A4 page at 150 DPI is ~1750px)
+PDF_MAX_PAGE_PX = 1536
+
+# A page is blank when fewer than 0.002% of its samples are darker than
+# BLANK_INK_LEVEL. Kept tiny on purpose: a lone 9pt "Total 500" is already
+# ~0.02% → only truly empty pages skip Gemini.
+BLANK_INK_LEVEL = 200
+BLANK_PAGE_MAX_INK = 0.00002
+# Yielded instead of a JPEG for blank pages
+BLANK_PAGE = b""
+
+
+def render_page(page):
+    zoom = min(
+        PDF_RENDER_DPI / 72,
+        PDF_MAX_PAGE_PX / max(page.rect.width, page.rect.height)
+    )
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+
+    samples = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    if np.count_nonzero(samples < BLANK_INK_LEVEL) < BLANK_PAGE_MAX_INK * samples.size:
+        return BLANK_PAGE
+
+    return pix.tobytes("jpeg", jpg_quality=PDF_JPEG_QUALITY)
+
+
+def render_pages(job):
+    """
+    Process-pool worker: renders pages [start, stop) of the PDF to JPEG.
+    Each worker opens its own fitz document (fitz is not thread-safe).
+    """
+    pdf_bytes, start, stop = job
+
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return [render_page(doc.load_page(i)) for i in range(start, stop)]